@@ -17,6 +17,7 @@
 
 import fnmatch
 import platform
+import time
 
 from oslo_config import cfg
 from oslo_log import log as logging
@@ -85,6 +86,13 @@ storpool_opts = [
 CONF = cfg.CONF
 CONF.register_opts(storpool_opts, group=configuration.SHARED_CONF_GROUP)
 
+# The volume type extra specs that retype() needs to look at.
+RETYPE_EXTRA_SPECS = frozenset(('volume_backend_name', 'storpool_template'))
+
+# How long (in seconds) to reuse the list of StorPool templates when
+# reporting the volume stats; the templates very rarely change.
+TEMPLATES_TTL = 300.0
+
 
 def _extract_cinder_ids(urls):
     ids = []
@@ -162,6 +170,11 @@ class StorPoolDriver(driver.VolumeDriver):
         self._ourIdInt = None
         self._attach = None
         self._use_iscsi = None
+        self._static_stats = {}
+        self._pool_skeletons = ()
+        self._pool_skeletons_key = None
+        self._templates = None
+        self._templates_ts = 0.0
 
     @staticmethod
     def get_driver_options():
@@ -749,10 +762,57 @@ class StorPoolDriver(driver.VolumeDriver):
 
         self._use_iscsi = export_to == "*"
 
+        self._static_stats = {
+            # Basic driver properties
+            'volume_backend_name': self.configuration.safe_get(
+                'volume_backend_name') or 'storpool',
+            'vendor_name': 'StorPool',
+            'driver_version': self.VERSION,
+            'storage_protocol': (
+                'iSCSI' if self._use_iscsi else 'storpool'
+            ),
+            # Driver capabilities
+            'clone_across_pools': True,
+            'sparse_copy_volume': True,
+        }
+        self._pool_skeletons = ()
+        self._pool_skeletons_key = None
+        self._templates = None
+
+    def _get_templates(self):
+        """Fetch the list of StorPool templates, reuse it for a while."""
+        now = time.monotonic()
+        if (self._templates is None or
+                now - self._templates_ts >= TEMPLATES_TTL):
+            self._templates = tuple(self._attach.api().volumeTemplatesList())
+            self._templates_ts = now
+        return self._templates
+
+    def _build_pool_skeletons(self, templates):
+        """Build the pool descriptions sans capacity, reuse them if able."""
+        names = tuple(t.name for t in templates)
+        if names != self._pool_skeletons_key:
+            common = {
+                'reserved_percentage': 0,
+                'multiattach': not self._use_iscsi,
+                'QoS_support': False,
+                'thick_provisioning_support': False,
+                'thin_provisioning_support': True,
+            }
+            self._pool_skeletons = tuple(
+                [dict(common, pool_name='default')] +
+                [dict(common,
+                      pool_name='template_' + name,
+                      storpool_template=name
+                      ) for name in names]
+            )
+            self._pool_skeletons_key = names
+        return self._pool_skeletons
+
     def _update_volume_stats(self):
         try:
             dl = self._attach.api().disksList()
-            templates = self._attach.api().volumeTemplatesList()
+            templates = self._get_templates()
         except spapi.ApiError as e:
             raise self._backendException(e)
         total = 0
@@ -764,44 +824,22 @@ class StorPoolDriver(driver.VolumeDriver):
                 continue
             total += desc.agCount * agSize
             used += desc.agAllocated * agSize
-            free += desc.agFree * agSize * 4096 / (4096 + 128)
+            free += desc.agFree * agSize * 4096 // (4096 + 128)
 
         # Report the free space as if all new volumes will be created
         # with StorPool replication 3; anything else is rare.
-        free /= self.configuration.storpool_replication
+        free //= self.configuration.storpool_replication
 
         space = {
-            'total_capacity_gb': total / units.Gi,
-            'free_capacity_gb': free / units.Gi,
-            'reserved_percentage': 0,
-            'multiattach': not self._use_iscsi,
-            'QoS_support': False,
-            'thick_provisioning_support': False,
-            'thin_provisioning_support': True,
+            'total_capacity_gb': total // units.Gi,
+            'free_capacity_gb': free // units.Gi,
         }
+        pools = [
+            dict(skel, **space)
+            for skel in self._build_pool_skeletons(templates)
+        ]
 
-        pools = [dict(space, pool_name='default')]
-
-        pools += [dict(space,
-                       pool_name='template_' + t.name,
-                       storpool_template=t.name
-                       ) for t in templates]
-
-        self._stats = {
-            # Basic driver properties
-            'volume_backend_name': self.configuration.safe_get(
-                'volume_backend_name') or 'storpool',
-            'vendor_name': 'StorPool',
-            'driver_version': self.VERSION,
-            'storage_protocol': (
-                'iSCSI' if self._use_iscsi else 'storpool'
-            ),
-            # Driver capabilities
-            'clone_across_pools': True,
-            'sparse_copy_volume': True,
-            # The actual pools data
-            'pools': pools
-        }
+        self._stats = dict(self._static_stats, pools=pools)
 
     def extend_volume(self, volume, new_size):
         size = int(new_size) * units.Gi
@@ -824,29 +862,32 @@ class StorPoolDriver(driver.VolumeDriver):
             LOG.error('Retype of encryption type not supported.')
             return False
 
+        specs = diff['extra_specs']
+        if not specs or RETYPE_EXTRA_SPECS.isdisjoint(specs):
+            return True
+
         templ = self.configuration.storpool_template
         repl = self.configuration.storpool_replication
-        if diff['extra_specs']:
-            for (k, v) in diff['extra_specs'].items():
-                if k == 'volume_backend_name':
-                    if v[0] != v[1]:
-                        # Retype of a volume backend not supported yet,
-                        # the volume needs to be migrated.
-                        return False
-                elif k == 'storpool_template':
-                    if v[0] != v[1]:
-                        if v[1] is not None:
-                            update['template'] = v[1]
-                        elif templ is not None:
-                            update['template'] = templ
-                        else:
-                            update['replication'] = repl
-                else:
-                    # We ignore any extra specs that we do not know about.
-                    # Let's leave it to Cinder's scheduler to not even
-                    # get this far if there is any serious mismatch between
-                    # the volume types.
-                    pass
+        for (k, v) in specs.items():
+            if k == 'volume_backend_name':
+                if v[0] != v[1]:
+                    # Retype of a volume backend not supported yet,
+                    # the volume needs to be migrated.
+                    return False
+            elif k == 'storpool_template':
+                if v[0] != v[1]:
+                    if v[1] is not None:
+                        update['template'] = v[1]
+                    elif templ is not None:
+                        update['template'] = templ
+                    else:
+                        update['replication'] = repl
+            else:
+                # We ignore any extra specs that we do not know about.
+                # Let's leave it to Cinder's scheduler to not even
+                # get this far if there is any serious mismatch between
+                # the volume types.
+                pass
 
         if update:
             name = self._attach.volumeName(volume['id'])
@@ -858,21 +899,34 @@ class StorPoolDriver(driver.VolumeDriver):
 
         return True
 
+    def _volume_exists(self, api, name):
+        """Check whether a StorPool volume with this name exists."""
+        try:
+            api.volumeList(name)
+            return True
+        except spapi.ApiError as e:
+            if e.name == 'objectDoesNotExist':
+                return False
+            raise
+
     def update_migrated_volume(self, context, volume, new_volume,
                                original_volume_status):
+        # The StorPool API has no batch or multi-rename request, so at
+        # least send all the requests below through the same API object.
+        api = self._attach.api()
+        vol_name = self._attach.volumeName
         orig_id = volume['id']
-        orig_name = self._attach.volumeName(orig_id)
+        orig_name = vol_name(orig_id)
         temp_id = new_volume['id']
-        temp_name = self._attach.volumeName(temp_id)
-        vols = {v.name: True for v in self._attach.api().volumesList()}
-        if temp_name not in vols:
+        temp_name = vol_name(temp_id)
+        if not self._volume_exists(api, temp_name):
             LOG.error('StorPool update_migrated_volume(): it seems '
                       'that the StorPool volume "%(tid)s" was not '
                       'created as part of the migration from '
                       '"%(oid)s".', {'tid': temp_id, 'oid': orig_id})
             return {'_name_id': new_volume['_name_id'] or new_volume['id']}
 
-        if orig_name in vols:
+        if self._volume_exists(api, orig_name):
             LOG.debug('StorPool update_migrated_volume(): both '
                       'the original volume "%(oid)s" and the migrated '
                       'StorPool volume "%(tid)s" seem to exist on '
@@ -881,32 +935,39 @@ class StorPoolDriver(driver.VolumeDriver):
             int_name = temp_name + '--temp--mig'
             LOG.debug('Trying to swap the volume names, intermediate "%(int)s"',
                       {'int': int_name})
+            done = []
             try:
-                LOG.debug('- rename "%(orig)s" to "%(int)s"',
-                    {'orig': orig_name, 'int': int_name})
-                self._attach.api().volumeUpdate(orig_name,
-                                                {'rename': int_name})
-
-                LOG.debug('- rename "%(temp)s" to "%(orig)s"',
-                    {'temp': temp_name, 'orig': orig_name})
-                self._attach.api().volumeUpdate(temp_name,
-                                                {'rename': orig_name})
-
-                LOG.debug('- rename "%(int)s" to "%(temp)s"',
-                    {'int': int_name, 'temp': temp_name})
-                self._attach.api().volumeUpdate(int_name,
-                                                {'rename': temp_name})
+                for (old, new) in ((orig_name, int_name),
+                                   (temp_name, orig_name),
+                                   (int_name, temp_name)):
+                    LOG.debug('- rename "%(old)s" to "%(new)s"',
+                              {'old': old, 'new': new})
+                    api.volumeUpdate(old, {'rename': new})
+                    done.append((old, new))
                 return {'_name_id': None}
             except spapi.ApiError as e:
                 LOG.error('StorPool update_migrated_volume(): '
                           'could not rename a volume: '
                           '%(err)s',
                           {'err': e})
-                return {'_name_id': new_volume['_name_id'] or new_volume['id']}
+
+            # Put the volumes back under their own names, since Cinder
+            # will be told that the migrated data is still in temp_name.
+            try:
+                for (old, new) in reversed(done):
+                    LOG.debug('- rename "%(new)s" back to "%(old)s"',
+                              {'old': old, 'new': new})
+                    api.volumeUpdate(new, {'rename': old})
+            except spapi.ApiError as e:
+                LOG.error('StorPool update_migrated_volume(): '
+                          'could not undo the renaming of the "%(oid)s" '
+                          'and "%(tid)s" volumes, manual intervention '
+                          'needed: %(err)s',
+                          {'oid': orig_id, 'tid': temp_id, 'err': e})
+            return {'_name_id': new_volume['_name_id'] or new_volume['id']}
 
         try:
-            self._attach.api().volumeUpdate(temp_name,
-                                            {'rename': orig_name})
+            api.volumeUpdate(temp_name, {'rename': orig_name})
             return {'_name_id': None}
         except spapi.ApiError as e:
             LOG.error('StorPool update_migrated_volume(): '
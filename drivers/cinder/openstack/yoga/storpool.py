@@ -17,15 +17,14 @@
 
 import fnmatch
 import platform
+import re
+import urllib.parse
 
 from oslo_config import cfg
 from oslo_log import log as logging
 from oslo_utils import excutils
 from oslo_utils import importutils
-from oslo_utils import netutils
 from oslo_utils import units
-from oslo_utils import uuidutils
-import six
 
 from cinder import context
 from cinder import exception
@@ -89,6 +88,10 @@ EXTRA_SPECS_NAMESPACE = 'storpool'
 EXTRA_SPECS_QOS = 'qos_class'
 ES_QOS = EXTRA_SPECS_NAMESPACE + ":" + EXTRA_SPECS_QOS
 
+_UUID_RE = re.compile(
+    r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-'
+    r'[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\Z')
+
 
 def _extract_cinder_ids(urls):
     ids = []
@@ -97,13 +100,13 @@ def _extract_cinder_ids(urls):
         # TypeError: a bytes-like object is required, not 'str'
         if not url:
             continue
-        parts = netutils.urlsplit(url)
+        parts = urllib.parse.urlsplit(url)
         if parts.scheme == 'cinder':
             if parts.path:
                 vol_id = parts.path.split('/')[-1]
             else:
                 vol_id = parts.netloc
-            if uuidutils.is_uuid_like(vol_id):
+            if _UUID_RE.match(vol_id):
                 ids.append(vol_id)
             else:
                 LOG.debug("Ignoring malformed image location uri "
@@ -166,6 +169,9 @@ class StorPoolDriver(driver.VolumeDriver):
         self._ourIdInt = None
         self._attach = None
         self._use_iscsi = None
+        self._iscsi_disabled = True
+        self._iscsi_export_pats = []
+        self._iscsi_export_re = None
 
     @staticmethod
     def get_driver_options():
@@ -174,6 +180,8 @@ class StorPoolDriver(driver.VolumeDriver):
     @staticmethod
     def qos_from_volume(volume):
         volume_type = volume['volume_type']
+        if volume_type is None:
+            return None
         extra_specs = \
             volume_types.get_volume_type_extra_specs(volume_type['id'])
         if extra_specs is not None:
@@ -181,16 +189,21 @@ class StorPoolDriver(driver.VolumeDriver):
         return None
 
     def _backendException(self, e):
-        return exception.VolumeBackendAPIException(data=six.text_type(e))
+        return exception.VolumeBackendAPIException(data=str(e))
 
-    def _template_from_volume(self, volume):
+    def _template_and_qos_from_volume(self, volume):
+        """Get the StorPool template and QoS class with a single query."""
         default = self.configuration.storpool_template
         vtype = volume['volume_type']
         if vtype is not None:
             specs = volume_types.get_volume_type_extra_specs(vtype['id'])
             if specs is not None:
-                return specs.get('storpool_template', default)
-        return default
+                return specs.get('storpool_template', default), \
+                    specs.get(ES_QOS)
+        return default, None
+
+    def _template_from_volume(self, volume):
+        return self._template_and_qos_from_volume(volume)[0]
 
     def get_pool(self, volume):
         template = self._template_from_volume(volume)
@@ -202,8 +215,7 @@ class StorPoolDriver(driver.VolumeDriver):
     def create_volume(self, volume):
         size = int(volume['size']) * units.Gi
         name = self._attach.volumeName(volume['id'])
-        template = self._template_from_volume(volume)
-        qos_class = StorPoolDriver.qos_from_volume(volume)
+        template, qos_class = self._template_and_qos_from_volume(volume)
 
         create_request = {'name': name, 'size': size}
 
@@ -244,6 +256,8 @@ class StorPoolDriver(driver.VolumeDriver):
         """
         if connector is None:
             return False
+        if self._iscsi_disabled and not connector.get('storpool_wants_iscsi'):
+            return False
         if self._use_iscsi:
             LOG.debug('  - forcing iSCSI for all exported volumes')
             return True
@@ -269,15 +283,14 @@ class StorPoolDriver(driver.VolumeDriver):
                       'iqn': iqn,
                   })
 
-        export_to = self.configuration.iscsi_export_to
-        if export_to is None:
+        if self._iscsi_export_re is None:
             return False
 
-        for pat in export_to.split():
-            LOG.debug('    - matching against %(pat)s', {'pat': pat})
-            if fnmatch.fnmatch(iqn, pat):
-                LOG.debug('      - got it!')
-                return True
+        LOG.debug('    - matching against %(pats)s',
+                  {'pats': self._iscsi_export_pats})
+        if self._iscsi_export_re.match(iqn):
+            LOG.debug('      - got it!')
+            return True
         LOG.debug('    - nope')
         return False
 
@@ -296,42 +309,38 @@ class StorPoolDriver(driver.VolumeDriver):
         cfg = self._attach.api().iSCSIConfig()
 
         pg_name = self.configuration.iscsi_portal_group
-        pg_found = [
-            pg for pg in cfg.iscsi.portalGroups.values() if pg.name == pg_name
-        ]
-        if not pg_found:
+        pg = next(
+            (pg for pg in cfg.iscsi.portalGroups.values()
+             if pg.name == pg_name),
+            None,
+        )
+        if pg is None:
             raise Exception('StorPool Cinder iSCSI configuration error: '
                             'no portal group "{pg}"'.format(pg=pg_name))
-        pg = pg_found[0]
 
         # Do we know about this initiator?
-        i_found = [
-            init for init in cfg.iscsi.initiators.values() if init.name == iqn
-        ]
-        if i_found:
-            initiator = i_found[0]
-        else:
-            initiator = None
+        initiator = next(
+            (init for init in cfg.iscsi.initiators.values()
+             if init.name == iqn),
+            None,
+        )
 
         # Is this volume already being exported?
         volname = self._attach.volumeName(volume_id)
-        t_found = [
-            tgt for tgt in cfg.iscsi.targets.values() if tgt.volume == volname
-        ]
-        if t_found:
-            target = t_found[0]
-        else:
-            target = None
+        target = next(
+            (tgt for tgt in cfg.iscsi.targets.values()
+             if tgt.volume == volname),
+            None,
+        )
 
         # OK, so is this volume being exported to this initiator?
         export = None
         if initiator is not None and target is not None:
-            e_found = [
-                exp for exp in initiator.exports
-                if exp.portalGroup == pg.name and exp.target == target.name
-            ]
-            if e_found:
-                export = e_found[0]
+            export = next(
+                (exp for exp in initiator.exports
+                 if exp.portalGroup == pg.name and exp.target == target.name),
+                None,
+            )
 
         return {
             'cfg': cfg,
@@ -363,6 +372,10 @@ class StorPoolDriver(driver.VolumeDriver):
             )
             raise
 
+        # Send all the needed changes in a single request; StorPool
+        # processes the commands in order, so the target will exist
+        # by the time the export is created.
+        commands = []
         if cfg['initiator'] is None:
             if not (self.configuration.iscsi_learn_initiator_iqns or
                     self.configuration.iscsi_cinder_volume and
@@ -375,23 +388,21 @@ class StorPoolDriver(driver.VolumeDriver):
                 LOG.info('Creating a StorPool iSCSI initiator '
                          'for "{host}s" ({iqn}s)',
                          {'host': connector['host'], 'iqn': iqn})
-                self._attach.api().iSCSIConfigChange({
-                    'commands': [
-                        {
-                            'createInitiator': {
-                                'name': iqn,
-                                'username': '',
-                                'secret': '',
-                            },
+                commands.extend([
+                    {
+                        'createInitiator': {
+                            'name': iqn,
+                            'username': '',
+                            'secret': '',
                         },
-                        {
-                            'initiatorAddNetwork': {
-                                'initiator': iqn,
-                                'net': '0.0.0.0/0',
-                            },
+                    },
+                    {
+                        'initiatorAddNetwork': {
+                            'initiator': iqn,
+                            'net': '0.0.0.0/0',
                         },
-                    ]
-                })
+                    },
+                ])
 
         if cfg['target'] is None:
             LOG.info(
@@ -402,16 +413,11 @@ class StorPoolDriver(driver.VolumeDriver):
                     'vol_id': volume['id'],
                 }
             )
-            self._attach.api().iSCSIConfigChange({
-                'commands': [
-                    {
-                        'createTarget': {
-                            'volumeName': cfg['volume_name'],
-                        },
-                    },
-                ]
+            commands.append({
+                'createTarget': {
+                    'volumeName': cfg['volume_name'],
+                },
             })
-            cfg = self._get_iscsi_config(iqn, volume['id'])
 
         if cfg['export'] is None:
             LOG.info('Creating a StorPool iSCSI export '
@@ -425,18 +431,21 @@ class StorPoolDriver(driver.VolumeDriver):
                          'iqn': iqn,
                          'pg': cfg['pg'].name
                      })
-            self._attach.api().iSCSIConfigChange({
-                'commands': [
-                    {
-                        'export': {
-                            'initiator': iqn,
-                            'portalGroup': cfg['pg'].name,
-                            'volumeName': cfg['volume_name'],
-                        },
-                    },
-                ]
+            commands.append({
+                'export': {
+                    'initiator': iqn,
+                    'portalGroup': cfg['pg'].name,
+                    'volumeName': cfg['volume_name'],
+                },
             })
 
+        if commands:
+            self._attach.api().iSCSIConfigChange({'commands': commands})
+
+        if cfg['target'] is None:
+            # Fetch the name that StorPool assigned to the new target.
+            cfg = self._get_iscsi_config(iqn, volume['id'])
+
         target_portals = [
             "{addr}:3260".format(addr=net.address)
             for net in cfg['pg'].networks
@@ -516,16 +525,18 @@ class StorPoolDriver(driver.VolumeDriver):
                 LOG.info('Looks like somebody beat us to it')
 
         if cfg['target'] is not None:
-            last = True
-            for initiator in cfg['cfg'].iscsi.initiators.values():
-                if initiator.name == cfg['initiator'].name:
-                    continue
-                for exp in initiator.exports:
-                    if exp.target == cfg['target'].name:
-                        last = False
-                        break
-                if not last:
-                    break
+            # Is this target still exported to any other initiators?
+            tgt_name = cfg['target'].name
+            my_init = (
+                cfg['initiator'].name if cfg['initiator'] is not None
+                else None
+            )
+            last = not any(
+                exp.target == tgt_name
+                for initiator in cfg['cfg'].iscsi.initiators.values()
+                if initiator.name != my_init
+                for exp in initiator.exports
+            )
 
             if last:
                 LOG.info(
@@ -612,13 +623,21 @@ class StorPoolDriver(driver.VolumeDriver):
             )
             return None, False
 
-        LOG.debug('On to parsing %(loc)s', {'loc': repr(image_location)})
+        if LOG.isEnabledFor(logging.DEBUG):
+            LOG.debug('On to parsing %(loc)s', {'loc': repr(image_location)})
         direct_url, locations = image_location
-        urls = list(set([direct_url] + [
-            loc.get('url') for loc in locations or []
-        ]))
+        # Only the cinder:// URLs are of any interest to us.
+        seen = set()
+        urls = []
+        for url in [direct_url] + [loc.get('url') for loc in locations or []]:
+            if not url or not url.startswith('cinder://') or url in seen:
+                continue
+            seen.add(url)
+            urls.append(url)
         image_volume_ids = _extract_cinder_ids(urls)
-        LOG.debug('image_volume_ids %(ids)s', {'ids': repr(image_volume_ids)})
+        if LOG.isEnabledFor(logging.DEBUG):
+            LOG.debug('image_volume_ids %(ids)s',
+                      {'ids': repr(image_volume_ids)})
 
         if not image_volume_ids:
             LOG.info('No Cinder volumes found to clone')
@@ -632,24 +651,28 @@ class StorPoolDriver(driver.VolumeDriver):
         refname = self._attach.volumeName(src_vref['id'])
         size = int(volume['size']) * units.Gi
         volname = self._attach.volumeName(volume['id'])
-        qos_class = StorPoolDriver.qos_from_volume(volume)
+        template, qos_class = self._template_and_qos_from_volume(volume)
 
         clone_request = {'name': volname, 'size': size}
 
         if qos_class is not None:
             clone_request['tags'] = {'qc': qos_class}
 
-        src_volume = self.db.volume_get(
-            context.get_admin_context(),
-            src_vref['id'],
-        )
-        src_template = self._template_from_volume(src_volume)
+        if src_vref.get('volume_type') is not None:
+            src_template = self._template_from_volume(src_vref)
+        else:
+            # clone_image() only passes the volume ID along.
+            src_volume = self.db.volume_get(
+                context.get_admin_context(),
+                src_vref['id'],
+            )
+            src_template = self._template_from_volume(src_volume)
 
-        template = self._template_from_volume(volume)
-        LOG.debug('clone volume id %(vol_id)s template %(template)s', {
-            'vol_id': repr(volume['id']),
-            'template': repr(template),
-        })
+        if LOG.isEnabledFor(logging.DEBUG):
+            LOG.debug('clone volume id %(vol_id)s template %(template)s', {
+                'vol_id': repr(volume['id']),
+                'template': repr(template),
+            })
         if template == src_template:
             LOG.info('Using baseOn to clone a volume into the same template')
             clone_request['baseOn'] = refname
@@ -757,15 +780,25 @@ class StorPoolDriver(driver.VolumeDriver):
             raise
 
         export_to = self.configuration.iscsi_export_to
-        export_to_set = export_to is not None and export_to.split()
+        export_to_pats = export_to.split() if export_to is not None else []
         vol_iscsi = self.configuration.iscsi_cinder_volume
         pg_name = self.configuration.iscsi_portal_group
-        if (export_to_set or vol_iscsi) and pg_name is None:
+        if (export_to_pats or vol_iscsi) and pg_name is None:
             msg = _('The "iscsi_portal_group" option is required if '
                     'any patterns are listed in "iscsi_export_to"')
             raise exception.VolumeDriverException(message=msg)
 
         self._use_iscsi = export_to == "*"
+        self._iscsi_disabled = not (export_to_pats or vol_iscsi)
+
+        # Match the initiator IQNs against all the patterns at once.
+        self._iscsi_export_pats = export_to_pats
+        if export_to_pats:
+            self._iscsi_export_re = re.compile('|'.join(
+                '(?:{pat})'.format(pat=fnmatch.translate(pat))
+                for pat in export_to_pats))
+        else:
+            self._iscsi_export_re = None
 
     def _update_volume_stats(self):
         try:
@@ -773,16 +806,11 @@ class StorPoolDriver(driver.VolumeDriver):
             templates = self._attach.api().volumeTemplatesList()
         except spapi.ApiError as e:
             raise self._backendException(e)
-        total = 0
-        used = 0
-        free = 0
         agSize = 512 * units.Mi
-        for (id, desc) in dl.items():
-            if desc.generationLeft != -1:
-                continue
-            total += desc.agCount * agSize
-            used += desc.agAllocated * agSize
-            free += desc.agFree * agSize * 4096 / (4096 + 128)
+        disks = [desc for desc in dl.values() if desc.generationLeft == -1]
+        total = sum(desc.agCount for desc in disks) * agSize
+        free = (sum(desc.agFree for desc in disks) * agSize *
+                4096 / (4096 + 128))
 
         # Report the free space as if all new volumes will be created
         # with StorPool replication 3; anything else is rare.
@@ -861,9 +889,9 @@ class StorPoolDriver(driver.VolumeDriver):
                             update['replication'] = repl
                 elif k == ES_QOS:
                     if v[1] is None:
-                        update['tags']['qc'] = ''
+                        update['tags'] = {'qc': ''}
                     elif v[0] != v[1]:
-                        update['tags'].update({'qc': v[1]})
+                        update['tags'] = {'qc': v[1]}
                 else:
                     # We ignore any extra specs that we do not know about.
                     # Let's leave it to Cinder's scheduler to not even
@@ -887,7 +915,7 @@ class StorPoolDriver(driver.VolumeDriver):
         orig_name = self._attach.volumeName(orig_id)
         temp_id = new_volume['id']
         temp_name = self._attach.volumeName(temp_id)
-        vols = {v.name: True for v in self._attach.api().volumesList()}
+        vols = {v.name for v in self._attach.api().volumesList()}
         if temp_name not in vols:
             LOG.error('StorPool update_migrated_volume(): it seems '
                       'that the StorPool volume "%(tid)s" was not '
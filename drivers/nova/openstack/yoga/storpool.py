@@ -40,19 +40,20 @@ class LibvirtStorPoolVolumeDriver(libvirt_volume.LibvirtVolumeDriver):
         return conf
 
     def connect_volume(self, connection_info, instance):
-        LOG.debug("Attaching StorPool volume %s",
-                  connection_info['data']['volume'], instance=instance)
         conn_info = connection_info['data']
+        LOG.debug("Attaching StorPool volume %s",
+                  conn_info['volume'], instance=instance)
         conn_info['instance'] = instance['uuid']
         device_info = self.connector.connect_volume(conn_info)
-        LOG.debug("Attached StorPool volume %s",
-                  device_info, instance=instance)
-        connection_info['data']['device_path'] = device_info['path']
+        LOG.debug("Attached StorPool volume %s at %s",
+                  conn_info['volume'], device_info['path'],
+                  instance=instance)
+        conn_info['device_path'] = device_info['path']
 
     def disconnect_volume(self, connection_info, instance, force=False):
-        LOG.debug("Detaching StorPool volume %s",
-                  connection_info['data']['volume'], instance=instance)
         conn_info = connection_info['data']
+        LOG.debug("Detaching StorPool volume %s",
+                  conn_info['volume'], instance=instance)
         conn_info['instance'] = instance['uuid']
         conn_info['is_shelve'] = False
         if instance['task_state'] in ('shelving',
@@ -66,10 +67,11 @@ class LibvirtStorPoolVolumeDriver(libvirt_volume.LibvirtVolumeDriver):
 
     def extend_volume(self, connection_info, instance, requested_size):
         """Extend the volume."""
+        conn_info = connection_info['data']
         LOG.debug("Extending StorPool volume %s",
-                  connection_info['data']['volume'], instance=instance)
-        new_size = self.connector.extend_volume(connection_info['data'])
+                  conn_info['volume'], instance=instance)
+        new_size = self.connector.extend_volume(conn_info)
         LOG.debug("Extended StorPool Volume %s; new_size=%s",
-                  connection_info['data']['device_path'],
+                  conn_info['device_path'],
                   new_size, instance=instance)
         return new_size